@@ -2,22 +2,85 @@
 import yfinance as yf
 import numpy as np
 import pandas as pd
+import argparse
 import datetime
+import os
 
-today = datetime.date.today()
-yesterday = today - datetime.timedelta(days=1)
-# To get yesterday's date
-start_date = '1988-01-01'
+tickers = ['^DJI', '^IXIC', '^GSPC', '^RUT']
+# Close values already downloaded, only the missing days are requested
+cache_file = os.path.join('cache', 'close.parquet')
+# The last cached business days are downloaded again, so that values filled in or corrected since are updated
+overlap = pd.offsets.BDay(10)
+csv_file_name = 'latest.csv'
 
-# Dealing with some missing values in Dow Jones index
-df = yf.download('^DJI ^IXIC ^GSPC ^RUT',start_date,str(yesterday))
-# Dealing with some missing values
-df = df.Close.dropna(axis=0)
-ts = np.asarray(df)
 
-# Calculate the log returns
-ratios = np.log(ts / np.roll(ts, -1, axis=0))[:-1]
+def main(verbose=False):
+    today = datetime.date.today()
+    yesterday = today - datetime.timedelta(days=1)
+    # To get yesterday's date
+    start_date = '1988-01-01'
 
-# Put the returns in a dataframe
-tsdf = pd.DataFrame(ratios, index = df.index[:-1])
-tsdf.to_csv("latest.csv")
\ No newline at end of file
+    try:
+        cached = pd.read_parquet(cache_file)
+        if sorted(cached.columns) != sorted(tickers):
+            # Tickers list was modified, the cache is no more relevant
+            raise ValueError
+        start_date = (cached.index.max() - overlap).strftime('%Y-%m-%d')
+    except (OSError, ValueError):
+        cached = None
+
+    close = cached
+    if start_date < str(yesterday):
+        # A single batched request for the four indices, fetched by yfinance threads
+        df = yf.download(' '.join(tickers), start_date, str(yesterday),
+                         threads=True, group_by='column', auto_adjust=False)
+        if not df.empty:
+            # A ticker that failed to download is still a column of the frame, filled with NaN
+            failed = df['Close'].reindex(columns=tickers).isna().all()
+            if failed.any():
+                raise RuntimeError(f'No close values downloaded for {list(failed.index[failed])}')
+            # Dealing with some missing values (e.g. in Dow Jones index)
+            new = df['Close'].dropna(axis=0)
+            if verbose:
+                print(f'{len(new)} days downloaded from {start_date}, dropped days with missing values:')
+                print(df.index.difference(new.index))
+            if cached is None:
+                close = new
+            else:
+                # Downloaded values replace the cached ones of the overlapping days
+                close = pd.concat([cached, new[cached.columns]])
+                close = close[~close.index.duplicated(keep='last')].sort_index()
+
+    if close is None or close.empty:
+        raise RuntimeError('No data could be downloaded')
+
+    # Nothing to do if no value was added nor revised, unless latest.csv is missing
+    if cached is not None and close.equals(cached) and os.path.exists(csv_file_name):
+        if verbose:
+            print(f'No new value, {csv_file_name} is unchanged')
+        return
+
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    close.to_parquet(cache_file)
+
+    ts = close.to_numpy()
+
+    # Calculate the log returns, i.e. log(ts[i] / ts[i + 1])
+    log_ts = np.log(ts, dtype=np.float64)
+    ratios = log_ts[:-1] - log_ts[1:]
+
+    # Put the returns in a dataframe
+    tsdf = pd.DataFrame(ratios, index = close.index[:-1])
+    # A large write buffer limits the number of write system calls
+    # newline="" is required by to_csv on a text handle, otherwise Windows gets "\r\r\n" line endings
+    with open(csv_file_name, "w", buffering=1 << 20, newline="", encoding="utf-8") as csv_file:
+        tsdf.to_csv(csv_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate latest.csv, the daily log returns of the four major US '
+                                                 'stock market indices.')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Print the downloaded and the dropped days.')
+    args = parser.parse_args()
+    main(verbose=args.verbose)
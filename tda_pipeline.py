@@ -10,7 +10,40 @@
 import numpy as np
 from sklearn.base import BaseEstimator, TransformerMixin
 from gudhi import RipsComplex
-from joblib import Parallel, delayed
+from joblib import Parallel, delayed, effective_n_jobs
+
+try:
+    from numba import njit, prange, get_num_threads, set_num_threads
+except ImportError:
+    # numba is optional, LPNorm falls back on NumPy
+    njit = None
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _lp_norms(landscapes):
+        # L1 and L2 norms of each row in a single sweep
+        n_landscapes, length = landscapes.shape
+        norms = np.empty((n_landscapes, 2))
+        for i in prange(n_landscapes):
+            l1 = 0.0
+            l2 = 0.0
+            for j in range(length):
+                value = landscapes[i, j]
+                l1 += abs(value)
+                l2 += value * value
+            norms[i, 0] = l1
+            norms[i, 1] = np.sqrt(l2)
+        return norms
+else:
+    _lp_norms = None
+
+
+def _select_windows(X, start, end, w):
+    # Data frame values can be column-major, rows must be contiguous for each window to be a contiguous block.
+    values = np.ascontiguousarray(X.values)
+    # A generator, so that the persistence computation starts before all the windows are selected.
+    # Each window is a view on values, no data is copied.
+    return (values[(idx - w):idx] for idx in range(start + w, end))
 
 
 class DataSelector(BaseEstimator, TransformerMixin):
@@ -18,7 +51,7 @@ class DataSelector(BaseEstimator, TransformerMixin):
     This is a class to select data from a data frame and set it with the correct format.
     """
 
-    def __init__(self, start=0, end=250, w=80, n_jobs=None):
+    def __init__(self, start=0, end=250, w=80, n_jobs=-1):
         """
         Constructor for the DataSelector class.
 
@@ -26,7 +59,7 @@ class DataSelector(BaseEstimator, TransformerMixin):
             start (date): The date index in the data frame to start the data analysis. Default value is `0`.
             end (date): The date index in the data frame to end the data analysis. Default value is `250`.
             w (int): The window size in days. Default value is `80`.
-            n_jobs (int): cf. https://joblib.readthedocs.io/en/latest/generated/joblib.Parallel.html
+            n_jobs (int): Ignored, windows selection is not parallelized. Default value is `-1`.
         """
         self.start = start
         self.end = end
@@ -47,11 +80,9 @@ class DataSelector(BaseEstimator, TransformerMixin):
             X (Pandas DataFrame): Indexed by date, time series of indices
 
         Returns:
-            For each day of the DataFrame, returns `w` points.
+            A generator that yields, for each day of the DataFrame, `w` points.
         """
-
-
-        return[X.iloc[(idx - self.w):idx].values for idx in range(self.start+self.w, self.end)]
+        return _select_windows(X, self.start, self.end, self.w)
 
 class RipsPersistence(BaseEstimator, TransformerMixin):
     """
@@ -67,7 +98,7 @@ class RipsPersistence(BaseEstimator, TransformerMixin):
         only_this_dim=-1,
         homology_coeff_field=11,
         min_persistence=0.0,
-        n_jobs=None,
+        n_jobs=-1,
     ):
         """
         Constructor for the RipsPersistence class.
@@ -86,6 +117,10 @@ class RipsPersistence(BaseEstimator, TransformerMixin):
             min_persistence (float): The minimum persistence value to take into account (strictly greater than
                 `min_persistence`). Default value is `0.0`. Sets `min_persistence` to `-1.0` to see all values.
             n_jobs (int): cf. https://joblib.readthedocs.io/en/latest/generated/joblib.Parallel.html
+                Default value is `-1`, i.e. all the CPUs are used. Set it to `1` for a sequential computation.
+                Threads are used by default. When the transformation is called repeatedly, wrap the calls in a
+                `with joblib.parallel_backend("loky"):` block to use the loky worker processes, that are kept alive
+                and reused from one call to the next.
         """
         self.max_rips_dimension=max_rips_dimension
         self.max_edge_length = max_edge_length
@@ -102,22 +137,7 @@ class RipsPersistence(BaseEstimator, TransformerMixin):
         """
         return self
 
-    def __transform(self, points):
-        rips = RipsComplex(points=points, max_edge_length=self.max_edge_length)
-        if self.collapse_edges:
-            stree = rips.create_simplex_tree(max_dimension=1)
-            stree.collapse_edges()
-            stree.expansion(self.max_rips_dimension)
-        else:
-            stree = rips.create_simplex_tree(max_dimension=self.max_rips_dimension)
-        stree.compute_persistence(
-            homology_coeff_field=self.homology_coeff_field, min_persistence=self.min_persistence
-        )
-        return [
-            stree.persistence_intervals_in_dimension(dim) for dim in range(self.max_persistence_dimension + 1)
-        ]
-
-    def __transform_only_this_dim(self, points):
+    def _compute_persistence(self, points):
         rips = RipsComplex(points=points, max_edge_length=self.max_edge_length)
         if self.collapse_edges:
             stree = rips.create_simplex_tree(max_dimension=1)
@@ -125,9 +145,20 @@ class RipsPersistence(BaseEstimator, TransformerMixin):
             stree.expansion(self.max_rips_dimension)
         else:
             stree = rips.create_simplex_tree(max_dimension=self.max_rips_dimension)
+        if self.only_this_dim == -1 and self.max_persistence_dimension > 0:
+            # All the persistence pairs in a single call, [(dim, (birth, death)), ...], split by dimension afterwards
+            pairs = stree.persistence(
+                homology_coeff_field=self.homology_coeff_field, min_persistence=self.min_persistence
+            )
+            dims = np.fromiter((dim for dim, _ in pairs), dtype=np.intp, count=len(pairs))
+            intervals = np.array([interval for _, interval in pairs], dtype=np.float64).reshape(-1, 2)
+            return [intervals[dims == dim] for dim in range(self.max_persistence_dimension + 1)]
+        # A single dimension is returned by one C++ call, without converting all the pairs in Python
         stree.compute_persistence(
             homology_coeff_field=self.homology_coeff_field, min_persistence=self.min_persistence
         )
+        if self.only_this_dim == -1:
+            return [stree.persistence_intervals_in_dimension(0)]
         return stree.persistence_intervals_in_dimension(self.only_this_dim)
 
     def transform(self, X, Y=None):
@@ -135,34 +166,89 @@ class RipsPersistence(BaseEstimator, TransformerMixin):
         Compute all the Rips complexes and their associated persistence diagrams.
 
         Parameters:
-            X (list of list of double OR list of numpy.ndarray): List of point clouds.
+            X (iterable of list of double OR iterable of numpy.ndarray): Point clouds, e.g. a list or a generator.
 
         Returns:
             Persistence diagrams in the format:
             - If `only_this_dim` was set to `n`: `[array( Hn(X[0]) ), array( Hn(X[1]) ), ...]` 
             - else: `[[array( H0(X[0]) ), array( H1(X[0]) ), ...], [array( H0(X[1]) ), array( H1(X[1]) ), ...], ...]` 
         """
+        # threads is preferred as rips construction and persistence computation releases the GIL
+        return Parallel(n_jobs=self.n_jobs, prefer="threads")(delayed(self._compute_persistence)(cells) for cells in X)
 
-        if self.only_this_dim == -1:
-            # threads is preferred as rips construction and persistence computation releases the GIL
-            return Parallel(n_jobs=self.n_jobs, prefer="threads")(delayed(self.__transform)(cells) for cells in X)
-        else:
-            # threads is preferred as rips construction and persistence computation releases the GIL
-            return Parallel(n_jobs=self.n_jobs, prefer="threads")(
-                delayed(self.__transform_only_this_dim)(cells) for cells in X
-            )
+class WindowedRipsPersistence(RipsPersistence):
+    """
+    This is a class for computing the persistence diagrams from a Rips complex on each window of a data frame.
+    It is equivalent to a :class:`DataSelector` followed by a :class:`RipsPersistence`, but the persistence
+    of each window is computed in a worker process.
+    """
+
+    def __init__(
+        self,
+        start=0,
+        end=250,
+        w=80,
+        max_rips_dimension=2,
+        max_edge_length=float("inf"),
+        collapse_edges=True,
+        max_persistence_dimension=0,
+        only_this_dim=-1,
+        homology_coeff_field=11,
+        min_persistence=0.0,
+        n_jobs=-1,
+    ):
+        """
+        Constructor for the WindowedRipsPersistence class.
+
+        Parameters:
+            start, end, w: cf. :class:`DataSelector`.
+            Other parameters: cf. :class:`RipsPersistence`.
+        """
+        super().__init__(
+            max_rips_dimension=max_rips_dimension,
+            max_edge_length=max_edge_length,
+            collapse_edges=collapse_edges,
+            max_persistence_dimension=max_persistence_dimension,
+            only_this_dim=only_this_dim,
+            homology_coeff_field=homology_coeff_field,
+            min_persistence=min_persistence,
+            n_jobs=n_jobs,
+        )
+        self.start = start
+        self.end = end
+        self.w = w
+
+    def transform(self, X, Y=None):
+        """
+        Compute the Rips complexes and their associated persistence diagrams of all the windows.
+
+        Parameters:
+            X (Pandas DataFrame): Indexed by date, time series of indices
+
+        Returns:
+            Persistence diagrams, for each day of the DataFrame, in the format of :meth:`RipsPersistence.transform`.
+        """
+        # processes are preferred, only the window is sent to the worker that computes its persistence.
+        # It is only a hint, a backend set by the caller with joblib.parallel_backend is used instead.
+        # loky worker processes are kept alive and reused by the next calls, no pool is spawned per call.
+        return Parallel(n_jobs=self.n_jobs, prefer="processes")(
+            delayed(self._compute_persistence)(window) for window in _select_windows(X, self.start, self.end, self.w)
+        )
 
 class LPNorm(BaseEstimator, TransformerMixin):
     """
     This is a class to compute Landscape Lp Norm L1 and L2.
     """
 
-    def __init__(self, n_jobs=None):
+    def __init__(self, n_jobs=-1):
         """
         Constructor for the LPNorm class.
 
         Parameters:
-            n_jobs (int): cf. https://joblib.readthedocs.io/en/latest/generated/joblib.Parallel.html
+            n_jobs (int): Number of numba threads, with the joblib conventions
+                (cf. https://joblib.readthedocs.io/en/latest/generated/joblib.Parallel.html).
+                Default value is `-1`, i.e. all the CPUs are used. Set it to `1` for a sequential computation.
+                Ignored when numba is not installed, the computation is then sequential.
         """
         self.n_jobs = n_jobs
 
@@ -173,17 +259,36 @@ class LPNorm(BaseEstimator, TransformerMixin):
         return self
 
     def __transform(self, landscape):
-        return [np.linalg.norm(landscape, ord=1), np.linalg.norm(landscape, ord=2)]
+        landscape = np.asarray(landscape, dtype=np.float64)
+        # Avoids np.linalg.norm arguments parsing and dispatch, costly for short landscapes
+        return [np.add.reduce(np.abs(landscape)), np.sqrt(np.dot(landscape, landscape))]
 
     def transform(self, X, Y=None):
         """
         Computes Landscape Lp Norm L1 and L2.
 
         Parameters:
-            X (numpy array): Landscape
+            X (numpy array or list of numpy array): Landscapes
 
         Returns:
             Lp Norm L1 and L2.
         """
-        return [[np.linalg.norm(landscape, ord=1), np.linalg.norm(landscape, ord=2)] for landscape in X]
-        #return Parallel(n_jobs=self.n_jobs)(delayed(self.__transform)(landscape) for landscape in X)
+        try:
+            landscapes = np.asarray(X, dtype=np.float64)
+        except ValueError:
+            # landscapes of different lengths cannot be stacked
+            landscapes = None
+        if landscapes is not None and landscapes.ndim == 2:
+            if _lp_norms is not None:
+                n_threads = get_num_threads()
+                # set_num_threads only applies to the calling thread, and cannot exceed numba's threads number
+                set_num_threads(min(effective_n_jobs(self.n_jobs), n_threads))
+                try:
+                    return _lp_norms(landscapes).tolist()
+                finally:
+                    set_num_threads(n_threads)
+            l1 = np.abs(landscapes).sum(axis=1)
+            # einsum fuses the square and the sum without any temporary array
+            l2 = np.sqrt(np.einsum("ij,ij->i", landscapes, landscapes))
+            return np.stack([l1, l2], axis=1).tolist()
+        return [self.__transform(landscape) for landscape in X]